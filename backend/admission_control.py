@@ -0,0 +1,214 @@
+"""
+Controle de admissão do servidor
+Limita a taxa de requisições por cliente (token bucket, com orçamentos separados
+para leitura e escrita) e a quantidade de chamadas simultâneas ao Supabase,
+descartando o excesso com 429/503 e Retry-After
+"""
+
+import hmac
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional
+from fastapi.responses import JSONResponse
+from request_profiling import timing_span
+
+READ_METHODS = {"GET", "HEAD"}
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"Limite de requisições excedido, tente em {retry_after:.1f}s")
+
+
+class ServerOverloaded(Exception):
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__("Servidor sobrecarregado, tente novamente em instantes")
+
+
+def retry_after_header(seconds: float) -> str:
+    """Valor do cabeçalho Retry-After (segundos inteiros, mínimo 1)"""
+    return str(max(1, math.ceil(seconds)))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        """Balde de fichas: `rate` fichas por segundo, até `burst` acumuladas"""
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Consumir uma ficha; devolve 0 ou os segundos até a próxima ficha"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+
+class AdmissionController:
+    def __init__(self):
+        """Configuração lida das variáveis de ambiente"""
+        self.enabled = os.getenv("ADMISSION_CONTROL", "true").lower() != "false"
+        self.budgets = {
+            "read": (float(os.getenv("RATE_LIMIT_READ_PER_SECOND", "5")),
+                     float(os.getenv("RATE_LIMIT_READ_BURST", "60"))),
+            "write": (float(os.getenv("RATE_LIMIT_WRITE_PER_SECOND", "0.5")),
+                      float(os.getenv("RATE_LIMIT_WRITE_BURST", "20"))),
+        }
+        self.max_clients = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000"))
+        # Só chaves cadastradas ganham balde próprio; as demais contam pelo IP
+        self.api_keys = {
+            key.strip().encode() for key in os.getenv("RATE_LIMIT_API_KEYS", "").split(",") if key.strip()
+        }
+        self.trust_proxy = os.getenv("TRUST_PROXY_HEADERS", "false").lower() == "true"
+        # Quantidade de proxies confiáveis que acrescentam entradas ao X-Forwarded-For
+        self.trusted_hops = max(1, int(os.getenv("TRUSTED_PROXY_HOPS", "1")))
+
+        self.max_in_flight = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "8"))
+        self.max_queue = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+        self.queue_timeout = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))
+        # Chamadas simultâneas ao Supabase (em threads do threadpool)
+        self._semaphore = threading.BoundedSemaphore(self.max_in_flight)
+        self._lock = threading.Lock()
+
+        # Baldes por cliente, descartando os menos recentes além de max_clients
+        self._buckets: OrderedDict = OrderedDict()
+        self.in_flight = 0
+        self.queued = 0
+        self.counters = {
+            "admitted": 0,
+            "rate_limited_read": 0,
+            "rate_limited_write": 0,
+            "shed_queue_full": 0,
+            "shed_queue_timeout": 0,
+        }
+
+    def client_key(self, headers, client_host: Optional[str]) -> str:
+        """Identificar o cliente pela chave de API cadastrada ou pelo IP"""
+        api_key = headers.get("x-api-key")
+        # Comparar bytes: compare_digest não aceita str com caracteres não ASCII
+        if api_key and any(hmac.compare_digest(api_key.encode(), key) for key in self.api_keys):
+            return f"key:{api_key}"
+        if self.trust_proxy:
+            # As entradas à esquerda vêm do cliente e podem ser forjadas: usar a
+            # entrada acrescentada pelo proxy confiável mais externo
+            forwarded = [entry.strip() for entry in headers.get("x-forwarded-for", "").split(",") if entry.strip()]
+            if len(forwarded) >= self.trusted_hops:
+                return f"ip:{forwarded[-self.trusted_hops]}"
+        return f"ip:{client_host or 'desconhecido'}"
+
+    def check_rate(self, client: str, method: str):
+        """Consumir do orçamento do cliente ou levantar RateLimitExceeded"""
+        kind = "read" if method in READ_METHODS else "write"
+        key = (client, kind)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(*self.budgets[kind])
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+
+        wait = bucket.take()
+        if wait > 0:
+            self.counters[f"rate_limited_{kind}"] += 1
+            raise RateLimitExceeded(wait)
+
+    @contextmanager
+    def upstream_slot(self):
+        """Reservar uma vaga para uma chamada ao Supabase (fila limitada)
+
+        Usado em volta das chamadas do SupabaseStorage, que rodam no threadpool:
+        a espera acontece na thread da requisição, sem bloquear o event loop
+        """
+        if not self.enabled:
+            yield
+            return
+
+        with self._lock:
+            if self.in_flight + self.queued >= self.max_in_flight + self.max_queue:
+                self.counters["shed_queue_full"] += 1
+                raise ServerOverloaded(self.queue_timeout)
+            self.queued += 1
+
+        with timing_span("admission_wait", "Fila do Supabase"):
+            acquired = self._semaphore.acquire(timeout=self.queue_timeout)
+        with self._lock:
+            self.queued -= 1
+            if not acquired:
+                self.counters["shed_queue_timeout"] += 1
+                raise ServerOverloaded(self.queue_timeout)
+            self.in_flight += 1
+            self.counters["admitted"] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._semaphore.release()
+
+    async def handle(self, request, call_next):
+        """Aplicar o limite por cliente a uma requisição HTTP"""
+        if not self.enabled or request.method == "OPTIONS" or not request.url.path.startswith("/api/prayers"):
+            return await call_next(request)
+
+        client = self.client_key(request.headers, request.client.host if request.client else None)
+        try:
+            self.check_rate(client, request.method)
+        except RateLimitExceeded as e:
+            return JSONResponse(
+                status_code=429,
+                content={"detail": str(e)},
+                headers={"Retry-After": retry_after_header(e.retry_after)}
+            )
+        return await call_next(request)
+
+    def overloaded_response(self, error: ServerOverloaded) -> JSONResponse:
+        """Resposta 503 para chamadas ao Supabase descartadas pela fila"""
+        return JSONResponse(
+            status_code=503,
+            content={"detail": str(error)},
+            headers={"Retry-After": retry_after_header(error.retry_after)}
+        )
+
+    def get_status(self) -> Dict:
+        """Contadores e configuração atuais (por worker)"""
+        return {
+            # Baldes, fila e contadores são deste worker: com N workers cada
+            # cliente pode usar até N vezes o orçamento configurado
+            "scope": "per_worker",
+            "worker_pid": os.getpid(),
+            "enabled": self.enabled,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "tracked_clients": len(self._buckets),
+            "budgets": {
+                kind: {"per_second": rate, "burst": burst}
+                for kind, (rate, burst) in self.budgets.items()
+            },
+            "counters": dict(self.counters),
+        }
+
+
+# Instância global
+admission_controller = None
+
+def get_admission_controller() -> AdmissionController:
+    """Obter instância do controle de admissão"""
+    global admission_controller
+    if admission_controller is None:
+        admission_controller = AdmissionController()
+    return admission_controller
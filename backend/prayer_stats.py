@@ -0,0 +1,257 @@
+"""
+Contadores incrementais das estatísticas de oração
+Mantém totais e a taxa de oração (EWMA) atualizados em O(1) a cada escrita,
+sem reler todo o histórico do Supabase. O estado fica no segmento compartilhado
+(shared_stats), visível para todos os workers
+"""
+
+import math
+import os
+import time
+from datetime import datetime
+from typing import List, Dict, Optional
+from shared_stats import get_shared_segment
+
+# Meta da campanha
+GOAL_HOURS = 1000
+
+# Janelas da média móvel exponencial (constante de tempo em segundos)
+RATE_WINDOWS = {
+    "24h": 24 * 3600,
+    "7d": 7 * 24 * 3600,
+}
+PRIMARY_WINDOW = "7d"
+
+# Intervalo de confiança de ~95%
+CONFIDENCE_Z = 1.96
+
+# Abaixo desta taxa (min/h) a atividade recente é considerada parada
+MIN_RATE_PER_HOUR = 0.01
+# Previsões além deste horizonte não são informadas
+MAX_FORECAST_SECONDS = 5 * 365 * 24 * 3600
+
+
+def parse_timestamp(value) -> float:
+    """Converter o datetime do Supabase em segundos (epoch)"""
+    if not value:
+        return time.time()
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return time.time()
+
+
+class RateWindow:
+    def __init__(self, tau: float):
+        """Soma com decaimento exponencial dos minutos orados"""
+        self.tau = tau
+        self.decayed_minutes = 0.0
+        self.decayed_squares = 0.0
+        self.last_update = None
+
+    def _decay_to(self, timestamp: float):
+        if self.last_update is None:
+            self.last_update = timestamp
+            return
+        if timestamp <= self.last_update:
+            return
+        factor = math.exp(-(timestamp - self.last_update) / self.tau)
+        self.decayed_minutes *= factor
+        self.decayed_squares *= factor * factor
+        self.last_update = timestamp
+
+    def apply(self, minutes: float, timestamp: float, sign: int = 1):
+        """Somar (ou subtrair) um registro feito em `timestamp`"""
+        self._decay_to(timestamp)
+        # Registros anteriores ao último evento entram já decaídos
+        weight = math.exp(-(self.last_update - timestamp) / self.tau)
+        self.decayed_minutes = max(0.0, self.decayed_minutes + sign * minutes * weight)
+        self.decayed_squares = max(0.0, self.decayed_squares + sign * (minutes * weight) ** 2)
+
+    def rate(self, now: float, history_seconds: float) -> Dict:
+        """Taxa em minutos de oração por hora e seu desvio padrão"""
+        if self.last_update is None:
+            return {"rate": 0.0, "stddev": 0.0}
+        factor = math.exp(-max(0.0, now - self.last_update) / self.tau)
+        # Corrige o viés quando o histórico é menor que a janela
+        coverage = 1 - math.exp(-max(history_seconds, 1.0) / self.tau)
+        effective_seconds = self.tau * coverage
+        rate = self.decayed_minutes * factor / effective_seconds * 3600
+        stddev = math.sqrt(self.decayed_squares) * factor / effective_seconds * 3600
+        return {"rate": rate, "stddev": stddev}
+
+
+class PrayerStatsTracker:
+    def __init__(self):
+        """Totais da campanha e taxa de oração compartilhados entre os workers"""
+        self.segment = get_shared_segment(len(RATE_WINDOWS))
+        self.rebuild_interval = float(os.getenv("STATS_REBUILD_SECONDS", "600"))
+        self.deadline = parse_timestamp(os.getenv("GOAL_DEADLINE", "2025-10-05T10:00:00-03:00"))
+
+    def _load_windows(self, state: Dict) -> Dict[str, RateWindow]:
+        windows = {}
+        for (name, tau), values in zip(RATE_WINDOWS.items(), state["windows"]):
+            window = RateWindow(tau)
+            window.decayed_minutes, window.decayed_squares, window.last_update = values
+            windows[name] = window
+        return windows
+
+    def _store_windows(self, state: Dict, windows: Dict[str, RateWindow]):
+        state["windows"] = [
+            (window.decayed_minutes, window.decayed_squares, window.last_update)
+            for window in windows.values()
+        ]
+
+    def is_ready(self) -> bool:
+        """Contadores aquecidos e recalculados recentemente"""
+        state = self.segment.read()
+        if not state["ready"] or state["rebuilt_at"] is None:
+            return False
+        # Recalcular periodicamente corrige alterações feitas fora da API
+        return time.time() - state["rebuilt_at"] < self.rebuild_interval
+
+    def get_data_version(self) -> int:
+        """Versão dos dados (incrementada a cada escrita em qualquer worker)"""
+        return self.segment.read()["data_version"]
+
+    def rebuild(self, prayers: List[Dict], expected_version: Optional[int] = None) -> bool:
+        """Recalcular tudo a partir do histórico completo (apenas no aquecimento)
+
+        Devolve False quando o recálculo foi descartado (escrita concorrente ou
+        histórico vazio com contadores já preenchidos)
+        """
+        entries = sorted(
+            (parse_timestamp(prayer.get("datetime")), prayer.get("time_minutes", 0) or 0)
+            for prayer in prayers
+        )
+        with self.segment.update(bump_version=False) as state:
+            if expected_version is not None and state["data_version"] != expected_version:
+                # Houve escrita durante a leitura do histórico: tentar de novo depois
+                print("⚠️  Dados alterados durante o recálculo - contadores não atualizados")
+                return False
+            if not prayers and state["total_prayers"] > 0:
+                # get_all_prayers devolve [] também em caso de erro: não zerar os contadores
+                print("⚠️  Histórico vazio com contadores preenchidos - contadores mantidos")
+                return False
+            state["total_prayers"] = 0
+            state["total_minutes"] = 0
+            state["first_timestamp"] = None
+            windows = {name: RateWindow(tau) for name, tau in RATE_WINDOWS.items()}
+            for timestamp, minutes in entries:
+                self._add(state, windows, minutes, timestamp)
+            self._store_windows(state, windows)
+            # Histórico vazio não fica marcado como pronto: reler na próxima consulta
+            state["ready"] = bool(prayers)
+            state["rebuilt_at"] = time.time()
+        print(f"📊 Contadores recalculados: {state['total_prayers']} orações, {state['total_minutes']} min")
+        return True
+
+    def invalidate(self):
+        """Forçar novo aquecimento na próxima leitura"""
+        with self.segment.update() as state:
+            state["ready"] = False
+
+    def _add(self, state: Dict, windows: Dict[str, RateWindow], minutes: int, timestamp: float):
+        state["total_prayers"] += 1
+        state["total_minutes"] += minutes
+        if state["first_timestamp"] is None or timestamp < state["first_timestamp"]:
+            state["first_timestamp"] = timestamp
+        for window in windows.values():
+            window.apply(minutes, timestamp)
+
+    def record_add(self, prayer: Dict):
+        """Registrar uma oração adicionada - O(1)"""
+        with self.segment.update() as state:
+            if not state["ready"]:
+                return
+            windows = self._load_windows(state)
+            self._add(state, windows, prayer.get("time_minutes", 0) or 0, parse_timestamp(prayer.get("datetime")))
+            self._store_windows(state, windows)
+
+    def record_delete(self, prayer: Dict):
+        """Registrar uma oração excluída - O(1)"""
+        with self.segment.update() as state:
+            if not state["ready"]:
+                return
+            if prayer.get("time_minutes") is None:
+                # Sem os dados da linha excluída não há como descontar: recalcular depois
+                state["ready"] = False
+                return
+            minutes = prayer.get("time_minutes", 0) or 0
+            timestamp = parse_timestamp(prayer.get("datetime"))
+            state["total_prayers"] = max(0, state["total_prayers"] - 1)
+            state["total_minutes"] = max(0, state["total_minutes"] - minutes)
+            windows = self._load_windows(state)
+            for window in windows.values():
+                window.apply(minutes, timestamp, sign=-1)
+            self._store_windows(state, windows)
+
+    def get_stats(self) -> Dict:
+        """Estatísticas no mesmo formato de get_prayer_stats"""
+        state = self.segment.read()
+        total_minutes = state["total_minutes"]
+        total_hours = total_minutes / 60
+        return {
+            "total_prayers": state["total_prayers"],
+            "total_minutes": total_minutes,
+            "total_hours": round(total_hours, 2),
+            "progress_percentage": round((total_hours / GOAL_HOURS) * 100, 2),
+            "remaining_hours": round(max(0, GOAL_HOURS - total_hours), 2),
+            "data_version": state["data_version"],
+        }
+
+    def get_forecast(self, now: Optional[float] = None) -> Dict:
+        """Taxa atual de oração e previsão de quando a meta será atingida"""
+        now = now if now is not None else time.time()
+        state = self.segment.read()
+        total_minutes = state["total_minutes"]
+        history_seconds = now - state["first_timestamp"] if state["first_timestamp"] else 0.0
+        windows = self._load_windows(state)
+        rates = {name: window.rate(now, history_seconds) for name, window in windows.items()}
+
+        remaining_minutes = max(0, GOAL_HOURS * 60 - total_minutes)
+        primary = rates[PRIMARY_WINDOW]
+        rate = primary["rate"]
+        rate_low = rate - CONFIDENCE_Z * primary["stddev"]
+        rate_high = rate + CONFIDENCE_Z * primary["stddev"]
+
+        def eta(rate_per_hour: float) -> Optional[float]:
+            if remaining_minutes == 0:
+                return now
+            if rate_per_hour < MIN_RATE_PER_HOUR:
+                return None
+            seconds = remaining_minutes / rate_per_hour * 3600
+            if seconds > MAX_FORECAST_SECONDS:
+                return None
+            return now + seconds
+
+        def iso(timestamp: Optional[float]) -> Optional[str]:
+            if not timestamp:
+                return None
+            try:
+                return datetime.fromtimestamp(timestamp).astimezone().isoformat()
+            except (OverflowError, ValueError, OSError):
+                return None
+
+        projected = eta(rate)
+        return {
+            "goal_hours": GOAL_HOURS,
+            "total_hours": round(total_minutes / 60, 2),
+            "remaining_hours": round(remaining_minutes / 60, 2),
+            "completed": remaining_minutes == 0,
+            "rate_window": PRIMARY_WINDOW,
+            "rate_minutes_per_hour": round(rate, 2),
+            "rates": {
+                name: {
+                    "minutes_per_hour": round(values["rate"], 2),
+                    "stddev": round(values["stddev"], 2),
+                }
+                for name, values in rates.items()
+            },
+            "projected_completion": iso(projected),
+            "completion_earliest": iso(eta(rate_high)),
+            "completion_latest": iso(eta(rate_low)),
+            "deadline": iso(self.deadline),
+            "on_track": projected is not None and projected <= self.deadline,
+            "data_version": state["data_version"],
+        }
@@ -0,0 +1,269 @@
+"""
+Perfilamento de requisições do servidor
+Registra o tempo de cada etapa (Supabase, cálculos, resposta) por requisição
+e devolve os tempos no cabeçalho Server-Timing
+"""
+
+import os
+import io
+import hmac
+import time
+import random
+import cProfile
+import pstats
+import threading
+import functools
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Dict, Optional
+from fastapi import HTTPException
+
+# Contexto de tempos da requisição atual (None fora de uma requisição)
+_current_timings: contextvars.ContextVar = contextvars.ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    def __init__(self, method: str = "", path: str = ""):
+        """Acumular os tempos de uma única requisição"""
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.spans: Dict[str, Dict] = {}
+        # Sorteada para perfilamento e o perfil coletado pelo handler
+        self.sampled = False
+        self.profile: Optional[cProfile.Profile] = None
+
+    def add_span(self, name: str, duration_ms: float, description: str = ""):
+        """Registrar uma etapa (etapas com o mesmo nome são somadas)"""
+        span = self.spans.get(name)
+        if span is None:
+            self.spans[name] = {"dur": duration_ms, "count": 1, "desc": description}
+        else:
+            span["dur"] += duration_ms
+            span["count"] += 1
+
+    def elapsed_ms(self) -> float:
+        """Tempo total desde o início da requisição"""
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing_header(self, total_ms: Optional[float] = None) -> str:
+        """Montar o valor do cabeçalho Server-Timing"""
+        entries = []
+        for name, span in self.spans.items():
+            entry = f"{name};dur={span['dur']:.2f}"
+            if span["desc"]:
+                entry += f';desc="{span["desc"]}"'
+            entries.append(entry)
+        if total_ms is not None:
+            entries.append(f"total;dur={total_ms:.2f}")
+        return ", ".join(entries)
+
+    def summary(self) -> str:
+        """Resumo legível para os logs"""
+        return ", ".join(f"{name}={span['dur']:.1f}ms x{span['count']}" for name, span in self.spans.items())
+
+
+def start_request(method: str = "", path: str = "") -> RequestTimings:
+    """Abrir o contexto de tempos para a requisição atual"""
+    timings = RequestTimings(method, path)
+    _current_timings.set(timings)
+    return timings
+
+
+def get_current_timings() -> Optional[RequestTimings]:
+    """Obter o contexto de tempos da requisição atual"""
+    return _current_timings.get()
+
+
+@contextmanager
+def timing_span(name: str, description: str = ""):
+    """Medir uma etapa da requisição atual (sem efeito fora de uma requisição)"""
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add_span(name, (time.perf_counter() - started) * 1000, description)
+
+
+class RequestProfiler:
+    def __init__(self):
+        """Configuração do perfilamento (ajustável pelo painel admin)"""
+        self.sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+        self.slow_request_ms = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+        self.profile_dir = os.getenv("PROFILE_DIR", "")
+        self.recent_profiles: deque = deque(maxlen=int(os.getenv("PROFILE_KEEP", "20")))
+        self.slow_requests: deque = deque(maxlen=50)
+        self.profiled_count = 0
+        self.slow_count = 0
+        # cProfile só admite um perfilador ativo por vez
+        self._profile_lock = threading.Lock()
+
+    def configure(self, sample_rate: Optional[float] = None, slow_request_ms: Optional[float] = None) -> Dict:
+        """Atualizar a configuração do perfilamento"""
+        if sample_rate is not None:
+            if not 0 <= sample_rate <= 1:
+                raise ValueError("sample_rate deve estar entre 0 e 1")
+            self.sample_rate = sample_rate
+        if slow_request_ms is not None:
+            if slow_request_ms < 0:
+                raise ValueError("slow_request_ms não pode ser negativo")
+            self.slow_request_ms = slow_request_ms
+        print(f"🔧 Perfilamento: amostragem {self.sample_rate:.2%}, lento acima de {self.slow_request_ms:.0f}ms")
+        return self.get_status()
+
+    def should_sample(self) -> bool:
+        """Sortear se a requisição será perfilada"""
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start_profile(self) -> Optional[cProfile.Profile]:
+        """Iniciar o cProfile na thread atual (None se outro perfil estiver ativo)"""
+        if not self._profile_lock.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Outro perfilador já está ativo no processo
+            self._profile_lock.release()
+            return None
+        return profiler
+
+    def stop_profile(self, profiler: cProfile.Profile):
+        """Encerrar o cProfile iniciado por start_profile"""
+        try:
+            profiler.disable()
+        finally:
+            self._profile_lock.release()
+
+    def finish_profile(self, timings: RequestTimings, total_ms: float):
+        """Guardar o perfil coletado durante o handler da requisição"""
+        profiler = timings.profile
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(30)
+
+        entry = {
+            "timestamp": datetime.now().isoformat(),
+            "method": timings.method,
+            "path": timings.path,
+            "total_ms": round(total_ms, 2),
+            "spans": timings.summary(),
+            # Só a execução do handler (na thread dele) entra no perfil
+            "scope": "handler",
+            "stats": output.getvalue(),
+        }
+
+        if self.profile_dir:
+            try:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                file_name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.prof"
+                file_path = os.path.join(self.profile_dir, file_name)
+                profiler.dump_stats(file_path)
+                entry["file"] = file_path
+            except Exception as e:
+                print(f"⚠️  Não foi possível salvar o perfil: {e}")
+
+        self.profiled_count += 1
+        self.recent_profiles.append(entry)
+        print(f"🔬 Perfil registrado: {timings.method} {timings.path} {total_ms:.1f}ms")
+
+    async def handle(self, request, call_next):
+        """Medir a requisição e devolver os tempos no cabeçalho Server-Timing"""
+        timings = start_request(request.method, request.url.path)
+        timings.sampled = self.should_sample()
+        try:
+            response = await call_next(request)
+        finally:
+            total_ms = timings.elapsed_ms()
+            if timings.profile is not None:
+                self.finish_profile(timings, total_ms)
+
+        spans_ms = sum(span["dur"] for span in timings.spans.values())
+        timings.add_span("app", max(0.0, total_ms - spans_ms), "FastAPI e serializacao")
+        response.headers["Server-Timing"] = timings.server_timing_header(total_ms)
+        response.headers["Timing-Allow-Origin"] = "*"
+        self.record_request(timings, total_ms, response.status_code)
+        return response
+
+    def record_request(self, timings: RequestTimings, total_ms: float, status_code: int):
+        """Registrar a requisição no log de lentidão se passar do limite"""
+        if total_ms < self.slow_request_ms:
+            return
+        self.slow_count += 1
+        self.slow_requests.append({
+            "timestamp": datetime.now().isoformat(),
+            "method": timings.method,
+            "path": timings.path,
+            "status_code": status_code,
+            "total_ms": round(total_ms, 2),
+            "spans": timings.summary(),
+        })
+        print(f"🐢 Requisição lenta: {timings.method} {timings.path} {total_ms:.1f}ms ({timings.summary()})")
+
+    def get_status(self) -> Dict:
+        """Estado atual do perfilamento"""
+        return {
+            # Configuração e contadores valem apenas para este worker
+            "worker_pid": os.getpid(),
+            "sample_rate": self.sample_rate,
+            "slow_request_ms": self.slow_request_ms,
+            "profile_dir": self.profile_dir or None,
+            "profiled_count": self.profiled_count,
+            "slow_count": self.slow_count,
+        }
+
+    def get_recent_profiles(self) -> List[Dict]:
+        """Perfis mais recentes"""
+        return list(self.recent_profiles)
+
+    def get_slow_requests(self) -> List[Dict]:
+        """Requisições lentas mais recentes"""
+        return list(self.slow_requests)
+
+
+def profiled_handler(func):
+    """Perfilar o handler quando a requisição foi sorteada
+
+    Os handlers que acessam o Supabase rodam no threadpool e o cProfile só mede a
+    thread em que foi ativado: por isso o perfil é coletado aqui, dentro do handler
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        timings = get_current_timings()
+        if timings is None or not timings.sampled:
+            return func(*args, **kwargs)
+        profiler = get_profiler()
+        profile = profiler.start_profile()
+        if profile is None:
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.stop_profile(profile)
+            timings.profile = profile
+    return wrapper
+
+
+def verify_admin(token: Optional[str]):
+    """Validar o token de administrador (variável ADMIN_TOKEN)"""
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token:
+        raise HTTPException(status_code=403, detail="Acesso admin desativado: ADMIN_TOKEN não configurado")
+    if not token or not hmac.compare_digest(token.encode(), admin_token.encode()):
+        raise HTTPException(status_code=401, detail="Token de administrador inválido")
+
+
+# Instância global
+request_profiler = None
+
+def get_profiler() -> RequestProfiler:
+    """Obter instância do perfilador de requisições"""
+    global request_profiler
+    if request_profiler is None:
+        request_profiler = RequestProfiler()
+    return request_profiler
@@ -4,7 +4,7 @@ TODOS os dados são salvos e lidos APENAS do Supabase
 NÃO há fallback para armazenamento local
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional
@@ -18,16 +18,43 @@ load_dotenv()
 
 # Importar sistema EXCLUSIVO Supabase
 from supabase_storage import get_storage
+from request_profiling import get_profiler, profiled_handler, verify_admin
+from admission_control import get_admission_controller, ServerOverloaded
 
 app = FastAPI(title="Sistema de Orações Igreja Videira - EXCLUSIVAMENTE Supabase")
 
-# Configurar CORS
+# Controle de admissão: limite por cliente (middleware) e fila limitada nas chamadas
+# ao Supabase (SupabaseStorage). As rotas que acessam o Supabase são `def` e rodam no
+# threadpool, para que as chamadas síncronas do supabase-py não bloqueiem o event loop
+admission = get_admission_controller()
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """Rejeitar com 429 o excesso de requisições de um mesmo cliente"""
+    return await admission.handle(request, call_next)
+
+@app.exception_handler(ServerOverloaded)
+async def server_overloaded(request: Request, error: ServerOverloaded):
+    """Fila de chamadas ao Supabase cheia: 503 com Retry-After"""
+    print(f"⚠️  Requisição descartada por sobrecarga: {request.method} {request.url.path}")
+    return admission.overloaded_response(error)
+
+# Perfilamento de requisições (Server-Timing, log de lentidão e cProfile por amostragem)
+profiler = get_profiler()
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    """Medir cada requisição e devolver os tempos no cabeçalho Server-Timing"""
+    return await profiler.handle(request, call_next)
+
+# Configurar CORS (registrado por último para envolver também as respostas 429/503)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
 # Modelos Pydantic
@@ -43,6 +70,10 @@ class PrayerUpdate(BaseModel):
     description: Optional[str] = None
     unit: Optional[str] = None
 
+class ProfilingConfig(BaseModel):
+    sample_rate: Optional[float] = None
+    slow_request_ms: Optional[float] = None
+
 # Inicializar armazenamento EXCLUSIVO Supabase
 try:
     storage = get_storage()
@@ -80,7 +111,8 @@ async def health_check():
         raise HTTPException(status_code=500, detail=f"Sistema não saudável: {str(e)}")
 
 @app.post("/api/prayers")
-async def add_prayer(prayer: PrayerRequest):
+@profiled_handler
+def add_prayer(prayer: PrayerRequest):
     """Adicionar nova oração - EXCLUSIVAMENTE no Supabase"""
     try:
         result = storage.add_prayer(
@@ -97,12 +129,15 @@ async def add_prayer(prayer: PrayerRequest):
             "storage": "supabase_only"
         }
         
+    except ServerOverloaded:
+        raise
     except Exception as e:
         print(f"❌ Erro ao adicionar oração: {e}")
         raise HTTPException(status_code=500, detail=f"Erro ao salvar no Supabase: {str(e)}")
 
 @app.get("/api/prayers")
-async def get_prayers():
+@profiled_handler
+def get_prayers():
     """Buscar todas as orações - EXCLUSIVAMENTE do Supabase"""
     try:
         prayers = storage.get_all_prayers()
@@ -114,12 +149,15 @@ async def get_prayers():
             "storage": "supabase_only"
         }
         
+    except ServerOverloaded:
+        raise
     except Exception as e:
         print(f"❌ Erro ao buscar orações: {e}")
         raise HTTPException(status_code=500, detail=f"Erro ao carregar do Supabase: {str(e)}")
 
 @app.get("/api/prayers/stats")
-async def get_prayer_stats():
+@profiled_handler
+def get_prayer_stats():
     """Obter estatísticas das orações - EXCLUSIVAMENTE do Supabase"""
     try:
         stats = storage.get_prayer_stats()
@@ -131,17 +169,41 @@ async def get_prayer_stats():
                 "total_hours": stats["total_hours"],
                 "total_minutes": stats["total_minutes"],
                 "progress_percentage": stats["progress_percentage"],
-                "remaining_hours": stats["remaining_hours"]
+                "remaining_hours": stats["remaining_hours"],
+                "data_version": stats["data_version"],
+                "stale": stats["stale"]
             },
             "storage": "supabase_only"
         }
         
+    except ServerOverloaded:
+        raise
     except Exception as e:
         print(f"❌ Erro ao calcular estatísticas: {e}")
         raise HTTPException(status_code=500, detail=f"Erro ao calcular estatísticas do Supabase: {str(e)}")
 
+@app.get("/api/prayers/forecast")
+@profiled_handler
+def get_prayer_forecast():
+    """Taxa atual de oração e previsão de conclusão da meta de 1000 horas"""
+    try:
+        forecast = storage.get_prayer_forecast()
+        
+        return {
+            "success": True,
+            "data": forecast,
+            "storage": "supabase_only"
+        }
+        
+    except ServerOverloaded:
+        raise
+    except Exception as e:
+        print(f"❌ Erro ao calcular previsão: {e}")
+        raise HTTPException(status_code=500, detail=f"Erro ao calcular previsão da meta: {str(e)}")
+
 @app.put("/api/prayers/{prayer_id}")
-async def update_prayer(prayer_id: str, updates: PrayerUpdate):
+@profiled_handler
+def update_prayer(prayer_id: str, updates: PrayerUpdate):
     """Atualizar oração - EXCLUSIVAMENTE no Supabase"""
     try:
         # Preparar dados para atualização
@@ -171,12 +233,15 @@ async def update_prayer(prayer_id: str, updates: PrayerUpdate):
             
     except HTTPException:
         raise
+    except ServerOverloaded:
+        raise
     except Exception as e:
         print(f"❌ Erro ao atualizar oração: {e}")
         raise HTTPException(status_code=500, detail=f"Erro ao atualizar no Supabase: {str(e)}")
 
 @app.delete("/api/prayers/{prayer_id}")
-async def delete_prayer(prayer_id: str):
+@profiled_handler
+def delete_prayer(prayer_id: str):
     """Excluir oração - EXCLUSIVAMENTE do Supabase"""
     try:
         success = storage.delete_prayer(prayer_id)
@@ -192,6 +257,8 @@ async def delete_prayer(prayer_id: str):
             
     except HTTPException:
         raise
+    except ServerOverloaded:
+        raise
     except Exception as e:
         print(f"❌ Erro ao excluir oração: {e}")
         raise HTTPException(status_code=500, detail=f"Erro ao excluir do Supabase: {str(e)}")
@@ -208,6 +275,45 @@ async def get_storage_info():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao obter informações: {str(e)}")
 
+@app.get("/api/admin/profiling")
+async def get_profiling(x_admin_token: Optional[str] = Header(None)):
+    """Estado do perfilamento, perfis recentes e requisições lentas (admin)"""
+    verify_admin(x_admin_token)
+    return {
+        "success": True,
+        "data": {
+            "config": profiler.get_status(),
+            "profiles": profiler.get_recent_profiles(),
+            "slow_requests": profiler.get_slow_requests()
+        }
+    }
+
+@app.get("/api/admin/admission")
+async def get_admission_status(x_admin_token: Optional[str] = Header(None)):
+    """Contadores do limite de requisições e da fila do Supabase (admin)"""
+    verify_admin(x_admin_token)
+    return {
+        "success": True,
+        "data": admission.get_status()
+    }
+
+@app.put("/api/admin/profiling")
+async def update_profiling(config: ProfilingConfig, x_admin_token: Optional[str] = Header(None)):
+    """Ajustar amostragem do cProfile e limite de requisição lenta (admin)"""
+    verify_admin(x_admin_token)
+    try:
+        status = profiler.configure(
+            sample_rate=config.sample_rate,
+            slow_request_ms=config.slow_request_ms
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "success": True,
+        "message": "Perfilamento atualizado",
+        "data": status
+    }
+
 if __name__ == "__main__":
     print("🚀 Iniciando servidor EXCLUSIVAMENTE Supabase...")
     print("📊 TODOS os dados serão salvos APENAS no Supabase")
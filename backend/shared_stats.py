@@ -0,0 +1,227 @@
+"""
+Segmento de memória compartilhada para as estatísticas da campanha
+Todos os workers do uvicorn leem e escrevem os mesmos totais (mmap de arquivo),
+então o aquecimento e os contadores valem para todos os processos
+"""
+
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+try:
+    import fcntl
+except ImportError:
+    # Sem fcntl (Windows) o segmento só é seguro dentro de um único processo
+    fcntl = None
+
+MAGIC = 0x56494431  # "VID1"
+LAYOUT_VERSION = 1
+
+# magic, layout, seq, data_version, ready, total_prayers, total_minutes, first_timestamp, rebuilt_at
+HEADER = struct.Struct("<IIQQQqqdd")
+SEQ_OFFSET = 8
+# decayed_minutes, decayed_squares, last_update (por janela EWMA)
+WINDOW = struct.Struct("<ddd")
+
+# Leitura sem lock: tentativas antes de recorrer ao flock
+READ_SPINS = 100
+READ_BACKOFF_MAX = 0.002
+
+
+def default_segment_path(table_name: str = "prayers") -> str:
+    """Arquivo do segmento (em /dev/shm quando disponível)
+
+    O nome inclui um hash do projeto Supabase e da tabela, para que duas
+    implantações no mesmo host (ex.: staging e produção) não compartilhem totais
+    """
+    if os.getenv("SHARED_STATS_PATH"):
+        return os.getenv("SHARED_STATS_PATH")
+    base_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    deployment = f"{os.getenv('SUPABASE_URL', '')}|{table_name}"
+    digest = hashlib.sha256(deployment.encode()).hexdigest()[:16]
+    return os.path.join(base_dir, f"videira_prayer_stats_{digest}.bin")
+
+
+def _none_to_nan(value) -> float:
+    return math.nan if value is None else float(value)
+
+
+def _nan_to_none(value: float):
+    return None if math.isnan(value) else value
+
+
+class SharedStatsSegment:
+    def __init__(self, window_count: int, path: str = None):
+        """Abrir (ou criar) o segmento compartilhado"""
+        self.window_count = window_count
+        self.path = path or default_segment_path()
+        self.size = HEADER.size + WINDOW.size * window_count
+        self._thread_lock = threading.Lock()
+
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._pid = os.getpid()
+        cold_start = self._attach()
+        with self._file_lock():
+            if os.fstat(self._fd).st_size < self.size:
+                os.ftruncate(self._fd, self.size)
+            self._mmap = mmap.mmap(self._fd, self.size)
+            magic, layout = struct.unpack_from("<II", self._mmap, 0)
+            if magic != MAGIC or layout != LAYOUT_VERSION:
+                self._write_state(self._empty_state(), seq=0)
+                print(f"🧩 Segmento de estatísticas criado: {self.path}")
+            else:
+                self._repair_seq()
+                if cold_start:
+                    # Segmento de uma execução anterior: exigir novo aquecimento
+                    state = self._unpack()
+                    state["ready"] = False
+                    self._write_state(state, seq=self._read_seq())
+                    print(f"🧩 Segmento de estatísticas reaproveitado após reinício: {self.path}")
+        self._downgrade_attach()
+
+    def _attach(self) -> bool:
+        """Registrar este processo no segmento; True se nenhum outro estiver ativo
+
+        Cada processo mantém um flock compartilhado em um arquivo auxiliar enquanto
+        estiver vivo; conseguir o lock exclusivo significa partida a frio
+        """
+        self._attach_fd = os.open(self.path + ".attach", os.O_RDWR | os.O_CREAT, 0o600)
+        if fcntl is None:
+            return True
+        try:
+            fcntl.flock(self._attach_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            fcntl.flock(self._attach_fd, fcntl.LOCK_SH)
+            return False
+
+    def _downgrade_attach(self):
+        if fcntl is not None:
+            fcntl.flock(self._attach_fd, fcntl.LOCK_SH)
+
+    def _empty_state(self) -> Dict:
+        return {
+            "data_version": 0,
+            "ready": False,
+            "total_prayers": 0,
+            "total_minutes": 0,
+            "first_timestamp": None,
+            "rebuilt_at": None,
+            "windows": [(0.0, 0.0, None)] * self.window_count,
+        }
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusão mútua entre threads e entre processos"""
+        with self._thread_lock:
+            if self._pid != os.getpid():
+                # Após fork (ex.: gunicorn --preload) o descritor herdado compartilha
+                # o flock com o processo pai: abrir um descritor próprio
+                inherited_fd = self._fd
+                self._fd = os.open(self.path, os.O_RDWR)
+                os.close(inherited_fd)
+                self._pid = os.getpid()
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _unpack(self) -> Dict:
+        (_, _, _, data_version, ready, total_prayers, total_minutes,
+         first_timestamp, rebuilt_at) = HEADER.unpack_from(self._mmap, 0)
+        windows = []
+        for index in range(self.window_count):
+            minutes, squares, last_update = WINDOW.unpack_from(self._mmap, HEADER.size + index * WINDOW.size)
+            windows.append((minutes, squares, _nan_to_none(last_update)))
+        return {
+            "data_version": data_version,
+            "ready": bool(ready),
+            "total_prayers": total_prayers,
+            "total_minutes": total_minutes,
+            "first_timestamp": _nan_to_none(first_timestamp),
+            "rebuilt_at": _nan_to_none(rebuilt_at),
+            "windows": windows,
+        }
+
+    def _write_state(self, state: Dict, seq: int):
+        HEADER.pack_into(
+            self._mmap, 0,
+            MAGIC, LAYOUT_VERSION, seq,
+            state["data_version"],
+            1 if state["ready"] else 0,
+            state["total_prayers"],
+            state["total_minutes"],
+            _none_to_nan(state["first_timestamp"]),
+            _none_to_nan(state["rebuilt_at"]),
+        )
+        for index, (minutes, squares, last_update) in enumerate(state["windows"]):
+            WINDOW.pack_into(self._mmap, HEADER.size + index * WINDOW.size,
+                             minutes, squares, _none_to_nan(last_update))
+
+    def _read_seq(self) -> int:
+        return struct.unpack_from("<Q", self._mmap, SEQ_OFFSET)[0]
+
+    def _repair_seq(self):
+        # Com o lock em mãos não há escrita em andamento: uma sequência ímpar
+        # indica um worker que morreu no meio da escrita
+        seq = self._read_seq()
+        if seq % 2:
+            struct.pack_into("<Q", self._mmap, SEQ_OFFSET, seq + 1)
+
+    def read(self) -> Dict:
+        """Ler um retrato consistente sem bloquear (seqlock)"""
+        backoff = 0.0
+        for _ in range(READ_SPINS):
+            seq_before = self._read_seq()
+            if seq_before % 2 == 0:
+                state = self._unpack()
+                if self._read_seq() == seq_before:
+                    return state
+            # Escrita em andamento em outro worker: esperar um pouco mais a cada vez
+            time.sleep(backoff)
+            backoff = min(READ_BACKOFF_MAX, backoff * 2 or 0.00005)
+        # Muita disputa (ou um worker morreu no meio da escrita): ler com o lock
+        with self._file_lock():
+            self._repair_seq()
+            return self._unpack()
+
+    @contextmanager
+    def update(self, bump_version: bool = True):
+        """Alterar o estado de forma atômica para todos os workers"""
+        with self._file_lock():
+            state = self._unpack()
+            yield state
+            seq = self._read_seq()
+            if bump_version:
+                state["data_version"] += 1
+            # Sequência ímpar sinaliza escrita em andamento para os leitores
+            struct.pack_into("<Q", self._mmap, SEQ_OFFSET, seq + 1)
+            self._write_state(state, seq=seq + 1)
+            struct.pack_into("<Q", self._mmap, SEQ_OFFSET, seq + 2)
+
+    def close(self):
+        """Liberar o mapeamento (o arquivo permanece para os outros workers)"""
+        self._mmap.close()
+        os.close(self._fd)
+        os.close(self._attach_fd)
+
+
+# Instância global
+shared_stats_segment = None
+
+def get_shared_segment(window_count: int) -> SharedStatsSegment:
+    """Obter o segmento compartilhado deste processo"""
+    global shared_stats_segment
+    if shared_stats_segment is None:
+        shared_stats_segment = SharedStatsSegment(window_count)
+    return shared_stats_segment
@@ -8,11 +8,16 @@ import os
 from datetime import datetime
 from typing import List, Dict, Optional
 from supabase_client import SupabaseManager
+from request_profiling import timing_span
+from admission_control import get_admission_controller, ServerOverloaded
+from prayer_stats import PrayerStatsTracker
 
 class SupabaseStorage:
     def __init__(self):
         """Inicializar sistema EXCLUSIVO Supabase"""
         self.supabase_manager = None
+        self.stats_tracker = PrayerStatsTracker()
+        self.admission = get_admission_controller()
         self._initialize_supabase()
     
     def _initialize_supabase(self):
@@ -40,14 +45,18 @@ class SupabaseStorage:
             if not self.supabase_manager:
                 raise Exception("❌ Supabase não inicializado!")
             
-            result = self.supabase_manager.add_prayer(name, time_minutes, description, unit)
+            with self.admission.upstream_slot(), timing_span("supabase_insert", "Supabase insert"):
+                result = self.supabase_manager.add_prayer(name, time_minutes, description, unit)
             
             if not result.get("success"):
                 raise Exception(f"❌ Erro ao salvar no Supabase: {result.get('error', 'Erro desconhecido')}")
             
+            self.stats_tracker.record_add(result.get("data") or {"time_minutes": time_minutes})
             print(f"✅ Oração salva no Supabase: {name} - {time_minutes} min")
             return result
             
+        except ServerOverloaded:
+            raise
         except Exception as e:
             print(f"❌ ERRO ao adicionar oração: {e}")
             raise Exception(f"Falha ao salvar no Supabase: {e}")
@@ -58,10 +67,13 @@ class SupabaseStorage:
             if not self.supabase_manager:
                 raise Exception("❌ Supabase não inicializado!")
             
-            prayers = self.supabase_manager.get_all_prayers()
+            with self.admission.upstream_slot(), timing_span("supabase_select", "Supabase select"):
+                prayers = self.supabase_manager.get_all_prayers()
             print(f"✅ {len(prayers)} orações carregadas do Supabase")
             return prayers
             
+        except ServerOverloaded:
+            raise
         except Exception as e:
             print(f"❌ ERRO ao buscar orações: {e}")
             raise Exception(f"Falha ao carregar do Supabase: {e}")
@@ -72,14 +84,19 @@ class SupabaseStorage:
             if not self.supabase_manager:
                 raise Exception("❌ Supabase não inicializado!")
             
-            result = self.supabase_manager.update_prayer(prayer_id, updates)
+            with self.admission.upstream_slot(), timing_span("supabase_update", "Supabase update"):
+                result = self.supabase_manager.update_prayer(prayer_id, updates)
             
             if not result.get("success"):
                 raise Exception(f"❌ Erro ao atualizar no Supabase: {result.get('error', 'Erro desconhecido')}")
             
+            # O valor anterior não é conhecido: recalcular na próxima leitura
+            self.stats_tracker.invalidate()
             print(f"✅ Oração atualizada no Supabase: ID {prayer_id}")
             return True
             
+        except ServerOverloaded:
+            raise
         except Exception as e:
             print(f"❌ ERRO ao atualizar oração: {e}")
             raise Exception(f"Falha ao atualizar no Supabase: {e}")
@@ -90,51 +107,71 @@ class SupabaseStorage:
             if not self.supabase_manager:
                 raise Exception("❌ Supabase não inicializado!")
             
-            result = self.supabase_manager.delete_prayer(prayer_id)
+            with self.admission.upstream_slot(), timing_span("supabase_delete", "Supabase delete"):
+                result = self.supabase_manager.delete_prayer(prayer_id)
             
             if not result.get("success"):
                 raise Exception(f"❌ Erro ao excluir do Supabase: {result.get('error', 'Erro desconhecido')}")
             
+            deleted = result.get("data")
+            if deleted:
+                self.stats_tracker.record_delete(deleted)
+            else:
+                self.stats_tracker.invalidate()
             print(f"✅ Oração excluída do Supabase: ID {prayer_id}")
             return True
             
+        except ServerOverloaded:
+            raise
         except Exception as e:
             print(f"❌ ERRO ao excluir oração: {e}")
             raise Exception(f"Falha ao excluir do Supabase: {e}")
     
+    def _ensure_stats_ready(self) -> bool:
+        """Aquecer os contadores compartilhados com o histórico completo
+
+        Devolve False se os contadores continuam desatualizados (escritas concorrentes)
+        """
+        if self.stats_tracker.is_ready():
+            return True
+        # Uma nova tentativa se houver escrita durante a leitura do histórico
+        for _ in range(2):
+            version = self.stats_tracker.get_data_version()
+            prayers = self.get_all_prayers()
+            with timing_span("stats_calc", "Soma das estatisticas"):
+                if self.stats_tracker.rebuild(prayers, expected_version=version):
+                    return True
+        return False
+    
     def get_prayer_stats(self) -> Dict:
         """Calcular estatísticas EXCLUSIVAMENTE do Supabase"""
         try:
-            prayers = self.get_all_prayers()
-            
-            if not prayers:
-                return {
-                    "total_prayers": 0,
-                    "total_minutes": 0,
-                    "total_hours": 0,
-                    "progress_percentage": 0,
-                    "remaining_hours": 1000,
-                    "storage_info": {"source": "supabase", "status": "connected"}
-                }
-            
-            total_minutes = sum(prayer.get("time_minutes", 0) for prayer in prayers)
-            total_hours = total_minutes / 60
-            progress_percentage = (total_hours / 1000) * 100
-            remaining_hours = max(0, 1000 - total_hours)
-            
-            return {
-                "total_prayers": len(prayers),
-                "total_minutes": total_minutes,
-                "total_hours": round(total_hours, 2),
-                "progress_percentage": round(progress_percentage, 2),
-                "remaining_hours": round(remaining_hours, 2),
-                "storage_info": {"source": "supabase", "status": "connected"}
-            }
-            
+            fresh = self._ensure_stats_ready()
+            stats = self.stats_tracker.get_stats()
+            stats["stale"] = not fresh
+            stats["storage_info"] = {"source": "supabase", "status": "connected"}
+            return stats
+            
+        except ServerOverloaded:
+            raise
         except Exception as e:
             print(f"❌ ERRO ao calcular estatísticas: {e}")
             raise Exception(f"Falha ao calcular estatísticas do Supabase: {e}")
     
+    def get_prayer_forecast(self) -> Dict:
+        """Previsão de conclusão da meta a partir da taxa de oração (EWMA)"""
+        try:
+            fresh = self._ensure_stats_ready()
+            forecast = self.stats_tracker.get_forecast()
+            forecast["stale"] = not fresh
+            return forecast
+            
+        except ServerOverloaded:
+            raise
+        except Exception as e:
+            print(f"❌ ERRO ao calcular previsão: {e}")
+            raise Exception(f"Falha ao calcular previsão da meta: {e}")
+    
     def get_storage_info(self) -> Dict:
         """Informações do armazenamento - EXCLUSIVAMENTE Supabase"""
         return {
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+# Os módulos do backend são importados pelo nome (ex.: `from shared_stats import ...`)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "backend"))
+
+import shared_stats  # noqa: E402
+from prayer_stats import RATE_WINDOWS, PrayerStatsTracker  # noqa: E402
+
+
+@pytest.fixture
+def segment_path(tmp_path):
+    return str(tmp_path / "stats.bin")
+
+
+@pytest.fixture
+def tracker(segment_path, monkeypatch):
+    """Tracker com segmento próprio em um arquivo temporário"""
+    segment = shared_stats.SharedStatsSegment(len(RATE_WINDOWS), path=segment_path)
+    monkeypatch.setattr(shared_stats, "shared_stats_segment", segment)
+    yield PrayerStatsTracker()
+    segment.close()
@@ -0,0 +1,226 @@
+import threading
+import time
+
+import pytest
+
+import admission_control
+from admission_control import (
+    AdmissionController,
+    RateLimitExceeded,
+    ServerOverloaded,
+    TokenBucket,
+    retry_after_header,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(admission_control.time, "monotonic", fake)
+    return fake
+
+
+def make_controller(monkeypatch, **env):
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    return AdmissionController()
+
+
+def test_token_bucket_burst_and_refill(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    assert bucket.take() == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.take() == 0
+    clock.now += 100
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    assert bucket.take() > 0
+
+
+def test_retry_after_header_is_whole_seconds():
+    assert retry_after_header(0.01) == "1"
+    assert retry_after_header(2.2) == "3"
+
+
+def test_rate_limit_per_kind(monkeypatch, clock):
+    controller = make_controller(monkeypatch, RATE_LIMIT_READ_BURST="2", RATE_LIMIT_WRITE_BURST="1")
+    controller.check_rate("ip:1", "GET")
+    controller.check_rate("ip:1", "GET")
+    controller.check_rate("ip:1", "POST")
+    with pytest.raises(RateLimitExceeded):
+        controller.check_rate("ip:1", "GET")
+    with pytest.raises(RateLimitExceeded):
+        controller.check_rate("ip:1", "DELETE")
+    assert controller.counters["rate_limited_read"] == 1
+    assert controller.counters["rate_limited_write"] == 1
+
+
+def test_unknown_api_keys_fall_back_to_ip(monkeypatch, clock):
+    controller = make_controller(monkeypatch, RATE_LIMIT_API_KEYS="chave-boa", RATE_LIMIT_READ_BURST="60")
+    assert controller.client_key({"x-api-key": "chave-boa"}, "1.2.3.4") == "key:chave-boa"
+    assert controller.client_key({"x-api-key": "inventada"}, "1.2.3.4") == "ip:1.2.3.4"
+
+    allowed = 0
+    for index in range(200):
+        client = controller.client_key({"x-api-key": f"rotativa-{index}"}, "1.2.3.4")
+        try:
+            controller.check_rate(client, "GET")
+            allowed += 1
+        except RateLimitExceeded:
+            pass
+    assert allowed == 60
+    assert controller.get_status()["tracked_clients"] == 1
+
+
+def test_forwarded_for_uses_trusted_hops_from_the_right(monkeypatch):
+    headers = {"x-forwarded-for": "6.6.6.6, 10.0.0.1, 10.0.0.2"}
+    controller = make_controller(monkeypatch)
+    assert controller.client_key(headers, "10.0.0.3") == "ip:10.0.0.3"
+
+    controller = make_controller(monkeypatch, TRUST_PROXY_HEADERS="true")
+    assert controller.client_key(headers, "10.0.0.3") == "ip:10.0.0.2"
+
+    controller = make_controller(monkeypatch, TRUST_PROXY_HEADERS="true", TRUSTED_PROXY_HOPS="2")
+    assert controller.client_key(headers, "10.0.0.3") == "ip:10.0.0.1"
+    assert controller.client_key({"x-forwarded-for": "10.0.0.9"}, "10.0.0.3") == "ip:10.0.0.3"
+
+
+def hold_slot(controller):
+    """Ocupar uma vaga em outra thread até `release` ser sinalizado"""
+    entered, release = threading.Event(), threading.Event()
+
+    def holder():
+        with controller.upstream_slot():
+            entered.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=holder)
+    thread.start()
+    assert entered.wait(5)
+    return thread, release
+
+
+def test_non_ascii_api_key_does_not_crash(monkeypatch):
+    controller = make_controller(monkeypatch, RATE_LIMIT_API_KEYS="chave-boa")
+    # O Starlette decodifica os cabeçalhos como latin-1
+    assert controller.client_key({"x-api-key": b"caf\xe9".decode("latin-1")}, "1.2.3.4") == "ip:1.2.3.4"
+
+
+def test_upstream_slot_sheds_when_queue_is_full(monkeypatch):
+    controller = make_controller(monkeypatch, ADMISSION_MAX_IN_FLIGHT="1",
+                                 ADMISSION_MAX_QUEUE="1", ADMISSION_QUEUE_TIMEOUT="5")
+    holder, release = hold_slot(controller)
+
+    def wait_for_slot():
+        with controller.upstream_slot():
+            pass
+
+    waiter = threading.Thread(target=wait_for_slot)
+    waiter.start()
+    while controller.queued == 0:
+        time.sleep(0.001)
+
+    with pytest.raises(ServerOverloaded):
+        with controller.upstream_slot():
+            pass
+    assert (controller.in_flight, controller.queued) == (1, 1)
+
+    release.set()
+    holder.join()
+    waiter.join()
+    assert controller.counters["shed_queue_full"] == 1
+    assert controller.counters["admitted"] == 2
+    assert (controller.in_flight, controller.queued) == (0, 0)
+
+
+def test_upstream_slot_sheds_after_queue_timeout(monkeypatch):
+    controller = make_controller(monkeypatch, ADMISSION_MAX_IN_FLIGHT="1",
+                                 ADMISSION_MAX_QUEUE="4", ADMISSION_QUEUE_TIMEOUT="0.05")
+    holder, release = hold_slot(controller)
+    with pytest.raises(ServerOverloaded) as error:
+        with controller.upstream_slot():
+            pass
+    assert error.value.retry_after == pytest.approx(0.05)
+    release.set()
+    holder.join()
+    assert controller.counters["shed_queue_timeout"] == 1
+    assert controller.queued == 0
+
+
+def test_upstream_slot_disabled(monkeypatch):
+    controller = make_controller(monkeypatch, ADMISSION_CONTROL="false", ADMISSION_MAX_IN_FLIGHT="1")
+    with controller.upstream_slot(), controller.upstream_slot():
+        pass
+    assert controller.counters["admitted"] == 0
+
+
+@pytest.fixture
+def app_factory(monkeypatch):
+    fastapi = pytest.importorskip("fastapi")
+    testclient = pytest.importorskip("fastapi.testclient")
+
+    def build(**env):
+        controller = make_controller(monkeypatch, **env)
+        app = fastapi.FastAPI()
+
+        @app.middleware("http")
+        async def admission(request, call_next):
+            return await controller.handle(request, call_next)
+
+        @app.exception_handler(ServerOverloaded)
+        async def overloaded(request, error):
+            return controller.overloaded_response(error)
+
+        @app.get("/api/prayers")
+        def prayers():
+            # Como no SupabaseStorage: a vaga envolve a chamada ao Supabase
+            with controller.upstream_slot():
+                return {"success": True}
+
+        @app.get("/api/health")
+        async def health():
+            return {"status": "healthy"}
+
+        return controller, testclient.TestClient(app)
+
+    return build
+
+
+def test_rate_limited_response_has_retry_after(app_factory):
+    controller, client = app_factory(RATE_LIMIT_READ_BURST="1", RATE_LIMIT_READ_PER_SECOND="0.5")
+    assert client.get("/api/prayers").status_code == 200
+    response = client.get("/api/prayers")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+    # Rotas fora de /api/prayers não passam pelo limite
+    assert client.get("/api/health").status_code == 200
+
+
+def test_overloaded_response_has_retry_after(app_factory):
+    controller, client = app_factory(ADMISSION_MAX_IN_FLIGHT="1", ADMISSION_MAX_QUEUE="0",
+                                     ADMISSION_QUEUE_TIMEOUT="3")
+    holder, release = hold_slot(controller)
+    response = client.get("/api/prayers")
+    release.set()
+    holder.join()
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
+    assert client.get("/api/prayers").status_code == 200
+
+
+def test_queue_wait_is_recorded_as_span(monkeypatch):
+    from request_profiling import start_request
+
+    controller = make_controller(monkeypatch)
+    timings = start_request("GET", "/api/prayers")
+    with controller.upstream_slot():
+        pass
+    assert timings.spans["admission_wait"]["count"] == 1
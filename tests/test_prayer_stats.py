@@ -0,0 +1,106 @@
+import math
+from datetime import datetime, timezone
+
+import pytest
+
+from prayer_stats import GOAL_HOURS, RateWindow
+
+DAY = 24 * 3600
+WEEK = 7 * DAY
+START = 1_750_000_000.0
+
+
+def iso(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat()
+
+
+def daily_prayers(days, minutes=60):
+    return [
+        {"time_minutes": minutes, "datetime": iso(START + day * DAY)}
+        for day in range(days)
+    ]
+
+
+def test_steady_rate_after_long_history(tracker):
+    assert tracker.rebuild(daily_prayers(60))
+    now = START + 59 * DAY + DAY / 2
+    forecast = tracker.get_forecast(now=now)
+    # 60 min por dia = 2,5 min por hora
+    assert forecast["rates"]["7d"]["minutes_per_hour"] == pytest.approx(2.5, abs=0.2)
+    assert forecast["rates"]["24h"]["minutes_per_hour"] == pytest.approx(2.5, abs=1.0)
+
+
+def test_short_history_is_bias_corrected(tracker):
+    tracker.rebuild(daily_prayers(3))
+    now = START + 2 * DAY + DAY / 2
+    rate = tracker.get_forecast(now=now)["rates"]["7d"]["minutes_per_hour"]
+    # Sem correção a janela de 7 dias daria ~0,9 min/h
+    assert rate == pytest.approx(2.5, abs=0.6)
+
+
+def test_rate_window_decays_and_subtracts():
+    window = RateWindow(WEEK)
+    window.apply(60, START)
+    window.apply(60, START + DAY)
+    assert window.decayed_minutes == pytest.approx(60 * math.exp(-1 / 7) + 60)
+    window.apply(60, START, sign=-1)
+    assert window.decayed_minutes == pytest.approx(60)
+
+
+def test_zero_rate_has_no_projection(tracker):
+    forecast = tracker.get_forecast(now=START)
+    assert forecast["rate_minutes_per_hour"] == 0
+    assert forecast["projected_completion"] is None
+    assert forecast["completion_latest"] is None
+    assert forecast["on_track"] is False
+
+
+def test_negative_lower_bound_has_no_latest_completion(tracker):
+    tracker.rebuild([{"time_minutes": 600, "datetime": iso(START)}])
+    forecast = tracker.get_forecast(now=START + 3600)
+    assert forecast["projected_completion"] is not None
+    assert forecast["completion_earliest"] is not None
+    assert forecast["completion_latest"] is None
+
+
+def test_completed_goal(tracker):
+    tracker.rebuild([{"time_minutes": GOAL_HOURS * 60, "datetime": iso(START)}])
+    forecast = tracker.get_forecast(now=START + DAY)
+    assert forecast["completed"] is True
+    assert forecast["remaining_hours"] == 0
+    assert forecast["projected_completion"] == forecast["completion_latest"]
+
+
+def test_add_and_delete_are_incremental(tracker):
+    tracker.rebuild(daily_prayers(3))
+    tracker.record_add({"time_minutes": 30, "datetime": iso(START + 3 * DAY)})
+    tracker.record_delete({"time_minutes": 60, "datetime": iso(START)})
+    stats = tracker.get_stats()
+    assert stats["total_prayers"] == 3
+    assert stats["total_minutes"] == 150
+
+
+def test_delete_without_row_invalidates(tracker):
+    tracker.rebuild(daily_prayers(3))
+    tracker.record_delete({})
+    assert not tracker.is_ready()
+    assert tracker.get_stats()["total_prayers"] == 3
+
+
+@pytest.mark.parametrize("idle_days", [30, 60, 365, 10 * 365])
+def test_long_idle_gap_has_no_projection(tracker, idle_days):
+    tracker.rebuild([{"time_minutes": 60, "datetime": iso(START)}])
+    forecast = tracker.get_forecast(now=START + idle_days * DAY)
+    assert forecast["rate_minutes_per_hour"] == 0
+    assert forecast["projected_completion"] is None
+    assert forecast["completion_earliest"] is None
+    assert forecast["completion_latest"] is None
+    assert forecast["on_track"] is False
+
+
+def test_empty_history_does_not_zero_filled_counters(tracker):
+    tracker.rebuild(daily_prayers(3))
+    tracker.invalidate()
+    assert tracker.rebuild([], expected_version=tracker.get_data_version()) is False
+    assert tracker.get_stats()["total_minutes"] == 180
+    assert not tracker.is_ready()
@@ -0,0 +1,150 @@
+import pytest
+
+import request_profiling
+from request_profiling import (
+    RequestProfiler,
+    RequestTimings,
+    profiled_handler,
+    start_request,
+    timing_span,
+    verify_admin,
+)
+
+
+@pytest.fixture
+def profiler(monkeypatch):
+    """Perfilador próprio, visto também por get_profiler()"""
+    instance = RequestProfiler()
+    monkeypatch.setattr(request_profiling, "request_profiler", instance)
+    return instance
+
+
+def test_spans_with_same_name_are_summed():
+    timings = RequestTimings("GET", "/api/prayers")
+    timings.add_span("supabase_select", 10.0, "Supabase select")
+    timings.add_span("supabase_select", 5.5, "Supabase select")
+    timings.add_span("stats_calc", 1.0)
+    assert timings.spans["supabase_select"] == {"dur": 15.5, "count": 2, "desc": "Supabase select"}
+    assert timings.summary() == "supabase_select=15.5ms x2, stats_calc=1.0ms x1"
+
+
+def test_server_timing_header_format():
+    timings = RequestTimings()
+    timings.add_span("supabase_select", 12.345, "Supabase select")
+    timings.add_span("stats_calc", 0.5)
+    assert timings.server_timing_header(20) == (
+        'supabase_select;dur=12.35;desc="Supabase select", stats_calc;dur=0.50, total;dur=20.00'
+    )
+    assert timings.server_timing_header() == 'supabase_select;dur=12.35;desc="Supabase select", stats_calc;dur=0.50'
+
+
+def test_timing_span_records_into_current_request():
+    timings = start_request("GET", "/api/prayers/stats")
+    with timing_span("stats_calc", "Calculo"):
+        pass
+    assert timings.spans["stats_calc"]["count"] == 1
+    assert timings.spans["stats_calc"]["dur"] >= 0
+
+
+def test_configure_validates_ranges(profiler):
+    with pytest.raises(ValueError):
+        profiler.configure(sample_rate=1.5)
+    with pytest.raises(ValueError):
+        profiler.configure(sample_rate=-0.1)
+    with pytest.raises(ValueError):
+        profiler.configure(slow_request_ms=-1)
+    status = profiler.configure(sample_rate=0.25, slow_request_ms=200)
+    assert status["sample_rate"] == 0.25
+    assert status["slow_request_ms"] == 200
+
+
+def test_slow_requests_above_threshold_are_logged(profiler):
+    profiler.configure(slow_request_ms=100)
+    timings = RequestTimings("GET", "/api/prayers")
+    profiler.record_request(timings, 99.9, 200)
+    assert profiler.get_slow_requests() == []
+
+    profiler.record_request(timings, 150.0, 503)
+    slow = profiler.get_slow_requests()
+    assert len(slow) == 1
+    assert slow[0]["path"] == "/api/prayers"
+    assert slow[0]["status_code"] == 503
+    assert profiler.get_status()["slow_count"] == 1
+
+
+def test_verify_admin_without_token_configured(monkeypatch):
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    with pytest.raises(request_profiling.HTTPException) as error:
+        verify_admin("qualquer")
+    assert error.value.status_code == 403
+
+
+def test_verify_admin_checks_token(monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "segredo")
+    for token in (None, "", "errado", "segrédo"):
+        with pytest.raises(request_profiling.HTTPException) as error:
+            verify_admin(token)
+        assert error.value.status_code == 401
+    verify_admin("segredo")
+
+
+@pytest.fixture
+def client(profiler):
+    fastapi = pytest.importorskip("fastapi")
+    testclient = pytest.importorskip("fastapi.testclient")
+    app = fastapi.FastAPI()
+
+    @app.middleware("http")
+    async def profiling(request, call_next):
+        return await profiler.handle(request, call_next)
+
+    @app.get("/api/prayers")
+    @profiled_handler
+    def prayers():
+        # Como no SupabaseStorage: etapas medidas dentro do handler (threadpool)
+        with timing_span("supabase_select", "Supabase select"):
+            sum(range(1000))
+        return {"success": True}
+
+    @app.get("/api/admin/profiling")
+    def admin(x_admin_token: str = fastapi.Header(None)):
+        verify_admin(x_admin_token)
+        return profiler.get_status()
+
+    return testclient.TestClient(app)
+
+
+def test_server_timing_header_in_response(client):
+    response = client.get("/api/prayers")
+    assert response.status_code == 200
+    names = [entry.split(";")[0] for entry in response.headers["Server-Timing"].split(", ")]
+    assert names == ["supabase_select", "app", "total"]
+    assert 'desc="Supabase select"' in response.headers["Server-Timing"]
+    assert response.headers["Timing-Allow-Origin"] == "*"
+
+
+def test_sampled_request_is_profiled(client, profiler):
+    client.get("/api/prayers")
+    assert profiler.get_recent_profiles() == []
+
+    profiler.configure(sample_rate=1)
+    client.get("/api/prayers")
+    profiles = profiler.get_recent_profiles()
+    assert len(profiles) == 1
+    assert profiles[0]["scope"] == "handler"
+    assert profiles[0]["path"] == "/api/prayers"
+    # O perfil foi coletado na thread do handler
+    assert "prayers" in profiles[0]["stats"]
+    assert profiler.get_status()["profiled_count"] == 1
+
+
+def test_admin_endpoint_gate(client, monkeypatch):
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    assert client.get("/api/admin/profiling").status_code == 403
+
+    monkeypatch.setenv("ADMIN_TOKEN", "segredo")
+    assert client.get("/api/admin/profiling").status_code == 401
+    assert client.get("/api/admin/profiling", headers={"X-Admin-Token": "errado"}).status_code == 401
+    response = client.get("/api/admin/profiling", headers={"X-Admin-Token": "segredo"})
+    assert response.status_code == 200
+    assert "sample_rate" in response.json()
@@ -0,0 +1,147 @@
+import multiprocessing
+import os
+import struct
+
+import pytest
+
+from shared_stats import SEQ_OFFSET, SharedStatsSegment, default_segment_path
+
+WINDOWS = 2
+WRITERS = 4
+UPDATES_PER_WRITER = 3000
+
+fork = pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(), reason="requer fork"
+)
+
+
+def _consistent_update(path, count):
+    segment = SharedStatsSegment(WINDOWS, path=path)
+    for _ in range(count):
+        with segment.update() as state:
+            # Invariante entre todos os campos: uma leitura rasgada o quebraria
+            prayers = state["total_prayers"] + 1
+            state["total_prayers"] = prayers
+            state["total_minutes"] = prayers * 3
+            state["first_timestamp"] = float(prayers)
+            state["windows"] = [(float(prayers), float(prayers * 2), float(prayers))] * WINDOWS
+    segment.close()
+
+
+def _check_reads(path, stop, result):
+    segment = SharedStatsSegment(WINDOWS, path=path)
+    reads = torn = 0
+    while not stop.is_set():
+        state = segment.read()
+        prayers = state["total_prayers"]
+        reads += 1
+        if prayers and (
+            state["total_minutes"] != prayers * 3
+            or state["first_timestamp"] != prayers
+            or any(window != (prayers, prayers * 2, prayers) for window in state["windows"])
+        ):
+            torn += 1
+    result.put((reads, torn))
+    segment.close()
+
+
+@fork
+def test_concurrent_writers_and_reader_never_see_torn_state(segment_path):
+    context = multiprocessing.get_context("fork")
+    SharedStatsSegment(WINDOWS, path=segment_path).close()
+    stop, result = context.Event(), context.Queue()
+    reader = context.Process(target=_check_reads, args=(segment_path, stop, result))
+    writers = [
+        context.Process(target=_consistent_update, args=(segment_path, UPDATES_PER_WRITER))
+        for _ in range(WRITERS)
+    ]
+    reader.start()
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    stop.set()
+    reads, torn = result.get(timeout=30)
+    reader.join()
+
+    segment = SharedStatsSegment(WINDOWS, path=segment_path)
+    state = segment.read()
+    assert state["total_prayers"] == WRITERS * UPDATES_PER_WRITER
+    assert state["data_version"] == WRITERS * UPDATES_PER_WRITER
+    assert reads > 0
+    assert torn == 0
+    segment.close()
+
+
+@fork
+def test_forked_children_reopen_descriptor(segment_path):
+    # O segmento é aberto no pai e herdado (como no gunicorn --preload)
+    segment = SharedStatsSegment(WINDOWS, path=segment_path)
+    context = multiprocessing.get_context("fork")
+
+    def increment():
+        inherited_fd = segment._fd
+        for _ in range(500):
+            with segment.update() as state:
+                state["total_prayers"] += 1
+        assert segment._pid != parent_pid
+        assert segment._fd != inherited_fd
+        # O descritor herdado foi fechado ao ser substituído
+        with pytest.raises(OSError):
+            os.fstat(inherited_fd)
+
+    parent_pid = segment._pid
+    children = [context.Process(target=increment) for _ in range(WRITERS)]
+    for child in children:
+        child.start()
+    for child in children:
+        child.join()
+        assert child.exitcode == 0
+    assert segment.read()["total_prayers"] == WRITERS * 500
+    segment.close()
+
+
+def test_read_repairs_seq_left_odd_by_dead_writer(segment_path):
+    segment = SharedStatsSegment(WINDOWS, path=segment_path)
+    with segment.update() as state:
+        state["total_prayers"] = 7
+    struct.pack_into("<Q", segment._mmap, SEQ_OFFSET, segment._read_seq() + 1)
+    assert segment.read()["total_prayers"] == 7
+    assert segment._read_seq() % 2 == 0
+    segment.close()
+
+
+def test_cold_start_clears_ready(segment_path):
+    first = SharedStatsSegment(WINDOWS, path=segment_path)
+    with first.update() as state:
+        state["ready"] = True
+    # Outro processo ativo: o estado aquecido é mantido
+    second = SharedStatsSegment(WINDOWS, path=segment_path)
+    assert second.read()["ready"] is True
+    second.close()
+    first.close()
+    # Nenhum processo ativo: o segmento restante exige novo aquecimento
+    restarted = SharedStatsSegment(WINDOWS, path=segment_path)
+    assert restarted.read()["ready"] is False
+    restarted.close()
+
+
+def test_default_path_depends_on_deployment(monkeypatch):
+    monkeypatch.delenv("SHARED_STATS_PATH", raising=False)
+    monkeypatch.setenv("SUPABASE_URL", "https://staging.supabase.co")
+    staging = default_segment_path()
+    monkeypatch.setenv("SUPABASE_URL", "https://prod.supabase.co")
+    assert default_segment_path() != staging
+    assert default_segment_path("outra_tabela") != default_segment_path()
+    monkeypatch.setenv("SHARED_STATS_PATH", "/tmp/explicito.bin")
+    assert default_segment_path() == "/tmp/explicito.bin"
+
+
+def test_rebuild_dropped_when_data_version_moves(tracker):
+    version = tracker.get_data_version()
+    tracker.record_add({"time_minutes": 10})
+    assert tracker.rebuild([{"time_minutes": 60}], expected_version=version) is False
+    assert not tracker.is_ready()
+    assert tracker.rebuild([{"time_minutes": 60}], expected_version=tracker.get_data_version())
+    assert tracker.is_ready()
+    assert tracker.get_stats()["total_minutes"] == 60